@@ -1,5 +1,6 @@
 import json
 import os
+import struct
 import subprocess
 import sys
 import tempfile
@@ -8,6 +9,7 @@ import unittest
 from contextlib import contextmanager
 from pathlib import Path
 
+import numpy
 import PIL.Image as Image
 
 
@@ -41,6 +43,93 @@ class TestCli(unittest.TestCase):
                 assert 128 < width <= (128+512)
                 assert 128 < height <= (128+512)
 
+                # Pixels not covered by any frame are transparent black
+                pixels = numpy.asarray(Image.open("atlas.png"))
+                covered = numpy.zeros((height, width), dtype=bool)
+                for x, y, w, h in (f for frames in map.values() for f in frames):
+                    top = height - y - h
+                    covered[top:top + h, x:x + w] = True
+                assert not covered.all()
+                assert not pixels[~covered].any()
+
+    def test_strip(self):
+        # A frame much longer than the others must not end up on a side of its
+        # own, making the atlas wider than the frame.
+        sizes = [(35, 102), (44, 168), (46, 169), (123, 24), (175, 153), (1825, 1)]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with pushd(temp_dir):
+                filenames = []
+                for width, height in sizes:
+                    filename = "%dx%d.png" % (width, height)
+                    Image.new("RGBA", (width, height), (255, 0, 0, 255)).save(filename)
+                    filenames.append(filename)
+
+                subprocess.check_call([sys.executable, "-m", "textureatlas"] + filenames)
+
+                image = Image.open("atlas.png")
+                width, height = image.size
+                image.close()
+
+                # The strip, plus at most two rows of the other frames
+                assert width == 1825
+                assert height <= 1 + 169 + 153
+
+    def test_multi_frame(self):
+        # The frames fit side by side but not stacked, so the atlas has to
+        # grow wider although its free regions are taller than any frame.
+        sizes = [(184, 118), (346, 367), (361, 280)]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with pushd(temp_dir):
+                filenames = []
+                for width, height in sizes:
+                    filename = "%dx%d.png" % (width, height)
+                    Image.new("RGBA", (width, height), (255, 0, 0, 255)).save(filename)
+                    filenames.append(filename)
+
+                subprocess.check_call([sys.executable, "-m", "textureatlas", "anim=" + " ".join(filenames)], timeout=60)
+                with open("atlas.map", "r", encoding="utf-8") as file:
+                    map = json.load(file)
+                    assert [tuple(f[2:]) for f in map["anim"]] == sizes
+
+                image = Image.open("atlas.png")
+                width, height = image.size
+                image.close()
+
+                assert width <= sum(w for w, _ in sizes)
+                assert height <= sum(h for _, h in sizes)
+
+    def test_binary(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            with pushd(temp_dir):
+                subprocess.check_call([sys.executable, "-m", "textureatlas", "-mf", "binary"] + list(samples_path.glob("*.png")))
+                with open("atlas.map", "rb") as file:
+                    data = file.read()
+
+                image = Image.open("atlas.png")
+                width, height = image.size
+                image.close()
+
+                (magic, map_width, map_height, num_textures,
+                 tex_off, tex_len, str_off, str_len, frm_off, frm_len) = struct.unpack_from("<4sIIIIIIIII", data)
+                assert magic == b"TEXA"
+                assert (map_width, map_height) == (width, height)
+                assert num_textures == 6
+                assert tex_off == 40 and tex_len == 6 * 12
+                assert str_off == tex_off + tex_len
+                assert frm_off == str_off + str_len and frm_len == 6 * 16
+                assert len(data) == frm_off + frm_len
+
+                names = data[str_off:str_off + str_len].split(b"\x00")[:-1]
+                assert sorted(names) == sorted(p.stem.encode() for p in samples_path.glob("*.png"))
+
+                for i in range(num_textures):
+                    name_off, num_frames, frame_off = struct.unpack_from("<III", data, tex_off + 12 * i)
+                    assert num_frames == 1
+                    name = data[str_off + name_off:].split(b"\x00")[0]
+                    x, y, w, h = struct.unpack_from("<IIII", data, frm_off + frame_off)
+                    assert (w, h) == tuple(map(int, name.split(b"x")))
+                    assert x + w <= width and y + h <= height
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,115 @@
+import io
+import json
+import struct
+import sys
+import unittest
+
+from textureatlas.textureatlas import (
+    BinaryTextureAtlasMap,
+    JsonTextureAtlasMap,
+    PackRegion,
+    Rect,
+    Texture,
+    TextureAtlas,
+)
+
+
+class TestPack(unittest.TestCase):
+
+    def test_deep_layout(self):
+        # One column per packable; a region tree would be as deep as the
+        # number of packables and exceed the recursion limit.
+        count = 2 * sys.getrecursionlimit()
+        region = PackRegion(0, 0, count + 1, 1)
+        rects = [Rect(0, 0, 1, 1) for _ in range(count)]
+        for rect in rects:
+            assert region.pack(rect)
+
+        assert sorted(r.x for r in rects) == list(range(count))
+        assert region.get_free_regions() == [(count, 0, 1, 1)]
+        assert not region.pack(Rect(0, 0, 2, 1))
+
+    def test_no_overlap(self):
+        region = PackRegion(0, 0, 64, 64)
+        rects = [Rect(0, 0, w, h) for w, h in [(32, 16), (16, 32), (8, 8)] * 3]
+        for rect in rects:
+            assert region.pack(rect)
+
+        for i, a in enumerate(rects):
+            assert a.x + a.width <= 64 and a.y + a.height <= 64
+            for b in rects[i + 1:]:
+                assert (a.x + a.width <= b.x or b.x + b.width <= a.x or
+                        a.y + a.height <= b.y or b.y + b.height <= a.y)
+
+    def test_best_fit_tie(self):
+        region = PackRegion(0, 0, 10, 10)
+        assert region.pack(Rect(0, 0, 6, 3))
+        assert region.get_free_regions() == [(6, 0, 4, 10), (0, 3, 6, 7)]
+
+        # Both regions leave a shortest side of 3; the second leaves the
+        # shorter longest side.
+        rect = Rect(0, 0, 1, 4)
+        assert region.pack(rect)
+        assert (rect.x, rect.y) == (0, 3)
+
+    def test_grow(self):
+        atlas = TextureAtlas(10, 10)
+        texture = Texture("a", [Rect(0, 0, 6, 6), Rect(0, 0, 6, 6)])
+        free = atlas.get_free_regions()
+        assert not atlas.pack_texture(texture)
+        assert atlas.get_free_regions() == free
+        assert atlas.textures == []
+
+        atlas.grow(16, 10)
+        assert atlas.get_free_regions() == [(0, 0, 16, 10)]
+        assert atlas.pack_texture(texture)
+        assert atlas.textures == [texture]
+        assert sorted((f.x, f.y) for f in texture.frames) == [(0, 0), (6, 0)]
+
+        atlas.shrink()
+        assert (atlas.width, atlas.height) == (12, 6)
+        assert atlas.perimeter == 36
+        assert atlas.get_free_regions() == []
+
+    def test_shared_frames(self):
+        atlas = TextureAtlas(8, 4)
+        shared, other = Rect(0, 0, 4, 4), Rect(0, 0, 4, 4)
+        assert atlas.pack_texture(Texture("a", [shared]))
+        assert atlas.pack_texture(Texture("b", [shared, other, shared]))
+        assert atlas.get_free_regions() == []
+        assert sorted((r.x, r.y) for r in (shared, other)) == [(0, 0), (4, 0)]
+
+    def test_grow_extends_edge_regions(self):
+        region = PackRegion(0, 0, 10, 10)
+        assert region.pack(Rect(0, 0, 4, 10))
+        assert region.pack(Rect(0, 0, 6, 4))
+        assert region.get_free_regions() == [(4, 4, 6, 6)]
+
+        region.grow(12, 14)
+        assert sorted(region.get_free_regions()) == [
+            (0, 10, 4, 4), (4, 4, 8, 10), (10, 0, 2, 4)]
+
+    def test_maps(self):
+        # Map writers only need frame geometry, not image files
+        atlas = TextureAtlas(8, 4)
+        shared = Rect(0, 0, 4, 4)
+        assert atlas.pack_texture(Texture("a", [shared, Rect(0, 0, 4, 2)]))
+        assert atlas.pack_texture(Texture("b", [shared]))
+
+        file = io.StringIO()
+        JsonTextureAtlasMap(atlas).write(file)
+        assert json.loads(file.getvalue()) == {
+            "a": [[0, 0, 4, 4], [4, 2, 4, 2]],
+            "b": [[0, 0, 4, 4]],
+        }
+
+        file = io.BytesIO()
+        BinaryTextureAtlasMap(atlas).write(file)
+        data = file.getvalue()
+        frm_off, frm_len = struct.unpack_from("<II", data, 32)
+        assert list(struct.iter_unpack("<IIII", data[frm_off:frm_off + frm_len])) == [
+            (0, 0, 4, 4), (4, 0, 4, 2), (0, 0, 4, 4)]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,12 @@
 import argparse
+import math
 import os.path
 import re
 import shlex
 import textwrap
 
+from concurrent.futures import ThreadPoolExecutor
+
 from textureatlas import (
     BinaryTextureAtlasMap,
     JsonTextureAtlasMap,
@@ -11,6 +14,9 @@ from textureatlas import (
     Texture,
     TextureAtlas,
     )
+from textureatlas.textureatlas import IO_WORKERS
+
+TEXTURE_RE = re.compile(r"^((\w+)=)?(.+)")
 
 
 def main():
@@ -70,10 +76,10 @@ def main():
         exit(1)
 
     # Parse texture names
-    textures = []
+    texture_frames = []
     for texture in args.textures:
         # Look for a texture name
-        matches = re.match(r"^((\w+)=)?(.+)", texture)
+        matches = TEXTURE_RE.match(texture)
         assert matches
 
         name, frames = matches.group(2), shlex.split(matches.group(3))
@@ -81,33 +87,71 @@ def main():
         # If no name was specified, use the first frame's filename
         name = name or os.path.splitext(os.path.basename(frames[0]))[0]
 
-        # Add frames to texture object list
-        textures.append(Texture(name, [Frame(f) for f in frames]))
+        texture_frames.append((name, frames))
+
+    # Open each distinct frame file once, overlapping image header reads.
+    # Textures naming the same file share its Frame, and so its place in the
+    # atlas.
+    filenames = list(dict.fromkeys(f for _, fs in texture_frames for f in fs))
+    with ThreadPoolExecutor(max_workers=IO_WORKERS) as executor:
+        frames = dict(zip(filenames, executor.map(Frame, filenames)))
+
+    # Add frames to texture object list
+    textures = [
+        Texture(name, [frames[f] for f in fs]) for name, fs in texture_frames
+    ]
+
+    # Sort textures by longest frame side, then frame area, then height, in
+    # non-increasing order. Sorting by area alone leaves long thin frames for
+    # last, when the atlas is too narrow for them and has to grow.
+    textures.sort(
+        key=lambda t: max(
+            (max(f.width, f.height), f.width * f.height, f.height) for f in t.frames
+        ),
+        reverse=True,
+    )
 
-    # Sort textures by perimeter size in non-increasing order
-    textures = sorted(textures, key=lambda t: t.frames[0].perimeter, reverse=True)
-    finished = False
-    largest_frame = textures[0].frames[0]
-    width, height = largest_frame.width, largest_frame.height
+    # Start no smaller than the widest and tallest frames, with a little more
+    # area than the distinct frames cover in total, so growing is rarely
+    # needed. The start is square unless a frame is wider than that square.
+    total_area = sum(f.width * f.height for f in frames.values()) * 11 // 10
+    width = max(max(f.width for f in frames.values()), math.isqrt(total_area))
+    height = max(max(f.height for f in frames.values()), -(-total_area // width))
     atlas = TextureAtlas(width, height)
 
-    while not finished:
-        finished = True
-        for texture in textures:
-            if atlas.pack_texture(texture):
-                continue
-
-            # Failed to pack the texture. Make the atlas larger...
-            finished = False
-            biggest_free_space = max(
-                atlas.get_free_regions(), key=lambda r: r.perimeter
-            )
-            if biggest_free_space.width < texture.frames[0].width:
-                width += texture.frames[0].width
+    for texture in textures:
+        grown = False
+        while not atlas.pack_texture(texture):
+            # Failed to pack the texture. Make the atlas larger, keeping the
+            # textures packed so far where they are...
+            frame_width = max(f.width for f in texture.frames)
+            frame_height = max(f.height for f in texture.frames)
+            if width < frame_width:
+                grow_width = True
+            elif height < frame_height:
+                grow_width = False
+            elif grown:
+                # Growing once was not enough. The free regions no longer tell
+                # which side blocks the texture (a texture that does not fit
+                # leaves them untouched), so grow the smaller side.
+                grow_width = width <= height
             else:
-                height += texture.frames[0].height
-            atlas = TextureAtlas(width, height)
-            break
+                _, _, free_width, _ = max(
+                    atlas.get_free_regions(),
+                    key=lambda r: r[2] + r[3],
+                    default=(0, 0, 0, 0),
+                )
+                grow_width = free_width < frame_width
+
+            if grow_width:
+                width = max(width * 2, width + frame_width)
+            else:
+                height = max(height * 2, height + frame_height)
+            atlas.grow(width, height)
+            grown = True
+
+    # Trim space left unused by growing the atlas
+    atlas.shrink()
 
     atlas.write(args.output_image_filename, args.image_mode)
     map_path = args.output_map_filename or (filename + ".map")
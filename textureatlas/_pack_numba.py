@@ -0,0 +1,54 @@
+"""Best fit search over free regions.
+
+The search is JIT compiled with Numba when it is installed, and vectorized
+with NumPy otherwise.
+"""
+
+import numpy as np
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+
+if njit is not None:
+
+    @njit(cache=True)
+    def best_fit(fw, fh, w, h, n):
+        """Index of the free region leaving the shortest leftover side, or -1.
+
+        Ties are broken by the longest leftover side.
+        """
+        best = -1
+        best_short = 2**31
+        best_long = 2**31
+        for i in range(n):
+            dw = fw[i] - w
+            dh = fh[i] - h
+            if dw >= 0 and dh >= 0:
+                s = dw if dw < dh else dh
+                l = dw if dw > dh else dh
+                if s < best_short or (s == best_short and l < best_long):
+                    best_short = s
+                    best_long = l
+                    best = i
+        return best
+
+else:
+
+    def best_fit(fw, fh, w, h, n):
+        """Index of the free region leaving the shortest leftover side, or -1.
+
+        Ties are broken by the longest leftover side.
+        """
+        dw = fw[:n].astype(np.int64) - w
+        dh = fh[:n].astype(np.int64) - h
+
+        # Regions that cannot hold the packable have a negative short side
+        short = np.minimum(dw, dh)
+        fits = np.flatnonzero(short >= 0)
+        if len(fits) == 0:
+            return -1
+        score = (short[fits] << 32) | np.maximum(dw, dh)[fits]
+        return int(fits[np.argmin(score)])
@@ -1,15 +1,38 @@
 from __future__ import annotations
 
 import json
+import os
 import struct
+import sys
+import threading
 
+from array import array
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import TextIO, BinaryIO
 
+import numpy as np
 import PIL.Image as Image
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-@dataclass
+from ._pack_numba import best_fit
+
+FREE_REGION_CAPACITY = 64
+MAX_OPEN_FRAMES = 256
+IO_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+DECODE_WINDOW = 2 * IO_WORKERS
+
+# Number of frames holding their image file open
+_open_frames = 0
+_open_frames_lock = threading.Lock()
+
+
+@dataclass(slots=True)
 class Rect:
     """A two-dimensional object."""
 
@@ -23,82 +46,221 @@ class Rect:
         return 2 * (self.width + self.height)
 
 
+def _uncovered(
+    start: int, end: int, starts: np.ndarray, lengths: np.ndarray
+) -> list[tuple[int, int]]:
+    """List the (start, length) spans of [start, end) not covered by the given
+    disjoint spans."""
+    spans = []
+    for s, length in sorted(zip(starts.tolist(), lengths.tolist())):
+        if s > start:
+            spans.append((start, s - start))
+        start = s + length
+    if start < end:
+        spans.append((start, end - start))
+    return spans
+
+
 class PackRegion(Rect):
-    """A region that Rect objects can be packed into."""
+    """A region that Rect objects can be packed into.
 
-    subregion_1: PackRegion | None = None
-    subregion_2: PackRegion | None = None
-    packable: Rect | None = None
+    Unpopulated space is tracked as a flat table of free rectangles, stored
+    column-wise in int32 arrays. A packable is placed into the free rectangle
+    that leaves the shortest leftover side (best short side fit, ties broken by
+    the longest leftover side), and that rectangle is then split in two.
+    """
 
     def __init__(self, x: int, y: int, width: int, height: int):
         super().__init__(x, y, width, height)
+        self.num_free = 0
+        self.free_x = np.empty(FREE_REGION_CAPACITY, np.int32)
+        self.free_y = np.empty(FREE_REGION_CAPACITY, np.int32)
+        self.free_w = np.empty(FREE_REGION_CAPACITY, np.int32)
+        self.free_h = np.empty(FREE_REGION_CAPACITY, np.int32)
+        self._add_free_region(x, y, width, height)
+
+    def _set_free_region(self, i: int, x: int, y: int, width: int, height: int):
+        self.free_x[i] = x
+        self.free_y[i] = y
+        self.free_w[i] = width
+        self.free_h[i] = height
+
+    def _add_free_region(self, x: int, y: int, width: int, height: int):
+        if self.num_free == len(self.free_x):
+            capacity = 2 * len(self.free_x)
+            self.free_x = np.resize(self.free_x, capacity)
+            self.free_y = np.resize(self.free_y, capacity)
+            self.free_w = np.resize(self.free_w, capacity)
+            self.free_h = np.resize(self.free_h, capacity)
+        self._set_free_region(self.num_free, x, y, width, height)
+        self.num_free += 1
+
+    def _remove_free_region(self, i: int):
+        self.num_free -= 1
+        last = self.num_free
+        self.free_x[i] = self.free_x[last]
+        self.free_y[i] = self.free_y[last]
+        self.free_w[i] = self.free_w[last]
+        self.free_h[i] = self.free_h[last]
+
+    def _save_free_regions(self) -> tuple[np.ndarray, ...]:
+        n = self.num_free
+        return (
+            self.free_x[:n].copy(),
+            self.free_y[:n].copy(),
+            self.free_w[:n].copy(),
+            self.free_h[:n].copy(),
+        )
+
+    def _restore_free_regions(self, saved: tuple[np.ndarray, ...]):
+        n = self.num_free = len(saved[0])
+        self.free_x[:n], self.free_y[:n], self.free_w[:n], self.free_h[:n] = saved
 
     def pack(self, packable: Rect) -> bool:
         """Pack 2D packable into this region."""
-        if self.packable is None:
-            # Is there room to pack this?
-            if (packable.width > self.width) or (packable.height > self.height):
-                return False
-
-            # Pack
-            packable.x, packable.y = self.x, self.y
-            self.packable = packable
+        width, height = packable.width, packable.height
+
+        # Find the best fitting free region
+        best = best_fit(self.free_w, self.free_h, width, height, self.num_free)
+        if best < 0:
+            return False
+
+        # Pack
+        x, y = int(self.free_x[best]), int(self.free_y[best])
+        free_width, free_height = int(self.free_w[best]), int(self.free_h[best])
+        packable.x, packable.y = x, y
+
+        # Split the remaining space into sub-regions, dropping empty ones
+        below = (x, y + height, width, free_height - height)
+        right = (x + width, y, free_width - width, free_height)
+        has_below = below[2] > 0 and below[3] > 0
+        has_right = right[2] > 0 and right[3] > 0
+
+        if has_below and has_right:
+            if below[2] * below[3] > right[2] * right[3]:
+                below, right = right, below
+            self._set_free_region(best, *below)
+            self._add_free_region(*right)
+        elif has_below:
+            self._set_free_region(best, *below)
+        elif has_right:
+            self._set_free_region(best, *right)
+        else:
+            self._remove_free_region(best)
+        return True
 
-            # Create sub-regions
-            self.subregion_1 = PackRegion(
-                self.x,
-                self.y + self.packable.height,
-                self.packable.width,
-                self.height - self.packable.height,
+    def grow(self, width: int, height: int) -> None:
+        """Enlarge this region, keeping everything packed so far in place.
+
+        Free regions along the old right and bottom edges are extended into the
+        new space, and the rest of it is added as new free regions.
+        """
+        if width > self.width:
+            right, extra = self.x + self.width, width - self.width
+            n = self.num_free
+            edge = np.flatnonzero(self.free_x[:n] + self.free_w[:n] == right)
+            self.free_w[edge] += extra
+            spans = _uncovered(
+                self.y, self.y + self.height, self.free_y[edge], self.free_h[edge]
             )
-            self.subregion_2 = PackRegion(
-                self.x + self.packable.width,
-                self.y,
-                self.width - self.packable.width,
-                self.height,
+            for y, h in spans:
+                self._add_free_region(right, y, extra, h)
+            self.width = width
+
+        if height > self.height:
+            bottom, extra = self.y + self.height, height - self.height
+            n = self.num_free
+            edge = np.flatnonzero(self.free_y[:n] + self.free_h[:n] == bottom)
+            self.free_h[edge] += extra
+            spans = _uncovered(
+                self.x, self.x + self.width, self.free_x[edge], self.free_w[edge]
             )
-            return True
-
-        assert self.subregion_1 is not None
-        assert self.subregion_2 is not None
-
-        # Pack into sub-region
-        if self.subregion_1.perimeter > self.subregion_2.perimeter:
-            return self.subregion_1.pack(packable) or self.subregion_2.pack(packable)
-        return self.subregion_2.pack(packable) or self.subregion_1.pack(packable)
-
-    def get_free_regions(self) -> list["PackRegion"]:
-        """List all unpopulated regions."""
-        if self.packable is None:
-            return [self]
-
-        assert self.subregion_1 is not None
-        assert self.subregion_2 is not None
-
-        return self.subregion_1.get_free_regions() + self.subregion_2.get_free_regions()
+            for x, w in spans:
+                self._add_free_region(x, bottom, w, extra)
+            self.height = height
+
+    def get_free_regions(self) -> list[tuple[int, int, int, int]]:
+        """List all unpopulated regions as (x, y, width, height) tuples."""
+        n = self.num_free
+        return list(
+            zip(
+                self.free_x[:n].tolist(),
+                self.free_y[:n].tolist(),
+                self.free_w[:n].tolist(),
+                self.free_h[:n].tolist(),
+            )
+        )
 
 
 class Frame(Rect):
-    """An image file that can be packed into a PackRegion."""
+    """An image file that can be packed into a PackRegion.
+
+    The image file is opened when the frame is created, which only reads the
+    image header, and the open file is reused by the first load() or draw().
+    To stay clear of the open file limit, at most MAX_OPEN_FRAMES frames keep
+    their file open; others reopen it when needed. A frame dropped without
+    being loaded or drawn closes its file when it is garbage collected, but
+    still counts towards that limit.
+    """
+
+    __slots__ = ("filename", "_image")
 
     def __init__(self, filename: str):
+        global _open_frames
+
         self.filename = filename
+        image = Image.open(filename)
 
         # Determine frame dimensions
-        image = Image.open(filename)
         width, height = image.size
-        del image
 
         super().__init__(0, 0, width, height)
 
+        # Keep the file open for drawing, unless too many frames already do
+        with _open_frames_lock:
+            keep = _open_frames < MAX_OPEN_FRAMES
+            if keep:
+                _open_frames += 1
+        if keep:
+            self._image = image
+        else:
+            self._image = None
+            image.close()
+
+    def _take(self) -> Image.Image | None:
+        """Take over the open image file of this frame, if it has one."""
+        global _open_frames
+
+        image, self._image = self._image, None
+        if image is not None:
+            with _open_frames_lock:
+                _open_frames -= 1
+        return image
+
+    def _close(self) -> None:
+        image = self._take()
+        if image is not None:
+            image.close()
+
+    def load(self) -> Image.Image:
+        """Decode the image data of this frame.
+
+        The returned image belongs to the caller, who should close it once done.
+        """
+        image = self._take()
+        if image is None:
+            image = Image.open(self.filename)
+        image.load()
+        return image
+
     def draw(self, image) -> None:
         """Draw this frame into another Image."""
-        i = Image.open(self.filename)
-        image.paste(i, (self.x, self.y))
-        del i
+        frame_image = self.load()
+        image.paste(frame_image, (self.x, self.y))
+        frame_image.close()
 
 
-@dataclass
+@dataclass(slots=True)
 class Texture:
     """A collection of one or more frames."""
 
@@ -112,21 +274,86 @@ class TextureAtlas(PackRegion):
     def __init__(self, width: int, height: int):
         super().__init__(0, 0, width, height)
         self.textures: list[Texture] = []
+        self._packed: set[int] = set()
 
     def pack_texture(self, texture: Texture) -> bool:
-        """Pack a Texture into this atlas."""
-        self.textures.append(texture)
+        """Pack a Texture into this atlas.
+
+        Frames already packed, by this or an earlier texture, keep their place
+        and are not packed again. If any other frame of the texture does not
+        fit, the atlas is left unchanged.
+        """
+        # A single frame that does not fit leaves the free regions untouched
+        saved = self._save_free_regions() if len(texture.frames) > 1 else None
+
+        packed = set()
         for frame in texture.frames:
+            if id(frame) in self._packed or id(frame) in packed:
+                continue
             if not super().pack(frame):
+                if saved is not None:
+                    self._restore_free_regions(saved)
                 return False
+            packed.add(id(frame))
+
+        self._packed |= packed
+        self.textures.append(texture)
         return True
 
+    def shrink(self) -> None:
+        """Shrink this atlas to the smallest size holding all packed frames."""
+        frames = [frame for texture in self.textures for frame in texture.frames]
+        width = max((f.x + f.width for f in frames), default=0)
+        height = max((f.y + f.height for f in frames), default=0)
+        self.width, self.height = width, height
+
+        # Clip free regions to the new bounds, dropping those left empty
+        n = self.num_free
+        x, y = self.free_x[:n], self.free_y[:n]
+        w = np.minimum(x + self.free_w[:n], width) - x
+        h = np.minimum(y + self.free_h[:n], height) - y
+        keep = np.flatnonzero((w > 0) & (h > 0))
+        self.num_free = n = len(keep)
+        self.free_x[:n], self.free_y[:n] = x[keep], y[keep]
+        self.free_w[:n], self.free_h[:n] = w[keep], h[keep]
+
     def write(self, filename: str, mode: str) -> None:
         """Generates the final texture atlas."""
         out = Image.new(mode, (self.width, self.height))
+
+        # Group frames by source file, so that each file is decoded only once
+        sources: dict[str, dict[int, Frame]] = {}
         for texture in self.textures:
             for frame in texture.frames:
-                frame.draw(out)
+                sources.setdefault(frame.filename, {})[id(frame)] = frame
+
+        def decode(frame: Frame) -> Image.Image:
+            image = frame.load()
+            if image.mode == mode:
+                return image
+            converted = image.convert(mode)
+            image.close()
+            return converted
+
+        def paste(frames: list[Frame], decoded: Future[Image.Image]) -> None:
+            image = decoded.result()
+            for frame in frames:
+                out.paste(image, (frame.x, frame.y))
+                frame._close()
+            image.close()
+
+        # Decode sources in the background; Image.paste is not thread-safe on
+        # the destination, so draw them one at a time, in order, as they become
+        # ready. At most DECODE_WINDOW decoded sources are held at once.
+        pending: deque[tuple[list[Frame], Future[Image.Image]]] = deque()
+        with ThreadPoolExecutor(max_workers=IO_WORKERS) as executor:
+            for shared in sources.values():
+                frames = list(shared.values())
+                pending.append((frames, executor.submit(decode, frames[0])))
+                if len(pending) >= DECODE_WINDOW:
+                    paste(*pending.popleft())
+            while pending:
+                paste(*pending.popleft())
         out.save(filename)
 
 
@@ -139,6 +366,11 @@ class BinaryTextureAtlasMap:
     strings referenced by other sections. The fourth section contains the
     coordinates and dimensions of all texture frames.
 
+    Every field listed below is an unsigned 32-bit integer stored in
+    little-endian byte order, regardless of the host that wrote the map, and
+    fields are packed without padding. The header is 40 bytes long, each
+    texture 12 bytes and each frame 16 bytes.
+
     HEADER FORMAT
 
     Offset Size Description
@@ -172,63 +404,77 @@ class BinaryTextureAtlasMap:
     12     4    Frame Height
     """
 
+    _HDR = struct.Struct("<4sIIIIIIIII")
+    _TEX = struct.Struct("<III")
+    _FRM = struct.Struct("<IIII")
+
     def __init__(self, atlas: TextureAtlas):
         self.atlas = atlas
 
     def write(self, file: BinaryIO):
         """Writes the binary texture atlas map file into file object."""
-        # Calculate offset and size of each section
-        hdr_fmt = "IIIIIIIII"
-        hdr_fmt_len = struct.calcsize(hdr_fmt)
-        hdr_section_len = hdr_fmt_len + 4  # Header + Magic
+        textures = self.atlas.textures
+        names = [t.name.encode("utf-8") for t in textures]
+        strings = b"".join(name + b"\x00" for name in names)
 
-        tex_fmt = "III"
-        tex_fmt_len = struct.calcsize(tex_fmt)
-        tex_section_off = hdr_section_len
-        tex_section_len = len(self.atlas.textures) * tex_fmt_len
+        # Calculate offset and size of each section
+        tex_section_off = self._HDR.size
+        tex_section_len = len(textures) * self._TEX.size
 
         str_section_off = tex_section_off + tex_section_len
-        str_section_len = sum(map(lambda t: len(t.name) + 1, self.atlas.textures))
+        str_section_len = len(strings)
 
-        frm_fmt = "IIII"
-        frm_fmt_len = struct.calcsize(frm_fmt)
         frm_section_off = str_section_off + str_section_len
-        frm_section_len = sum(map(lambda t: len(t.frames), self.atlas.textures))
-        frm_section_len *= frm_fmt_len
-
-        # Write Header
-        file.write(b"TEXA")
-        file.write(
-            struct.pack(
-                hdr_fmt,
-                self.atlas.width,
-                self.atlas.height,
-                len(self.atlas.textures),
-                tex_section_off,
-                tex_section_len,
-                str_section_off,
-                str_section_len,
-                frm_section_off,
-                frm_section_len,
-            )
+        frm_section_len = sum(map(lambda t: len(t.frames), textures))
+        frm_section_len *= self._FRM.size
+
+        buf = bytearray(frm_section_off + frm_section_len)
+
+        # Header
+        self._HDR.pack_into(
+            buf,
+            0,
+            b"TEXA",
+            self.atlas.width,
+            self.atlas.height,
+            len(textures),
+            tex_section_off,
+            tex_section_len,
+            str_section_off,
+            str_section_len,
+            frm_section_off,
+            frm_section_len,
         )
 
-        # Write Texture Section
+        # Texture Section
+        pack_tex, tex_size = self._TEX.pack_into, self._TEX.size
+        off = tex_section_off
         str_offset = 0
         frm_offset = 0
-        for t in self.atlas.textures:
-            file.write(struct.pack(tex_fmt, str_offset, len(t.frames), frm_offset))
-            str_offset += len(t.name) + 1  # +1 for sentinel byte
-            frm_offset += len(t.frames) * frm_fmt_len
-
-        # Write String Section
-        for t in self.atlas.textures:
-            file.write(t.name.encode("utf-8") + b"\x00")
+        for t, name in zip(textures, names):
+            pack_tex(buf, off, str_offset, len(t.frames), frm_offset)
+            off += tex_size
+            str_offset += len(name) + 1  # +1 for sentinel byte
+            frm_offset += len(t.frames) * self._FRM.size
+
+        # String Section
+        buf[str_section_off:frm_section_off] = strings
+
+        # Frame Section, as one contiguous array of native integers
+        frames = array(
+            "I",
+            [
+                v
+                for t in textures
+                for f in t.frames
+                for v in (f.x, f.y, f.width, f.height)
+            ],
+        )
+        if sys.byteorder == "big":
+            frames.byteswap()
+        buf[frm_section_off:] = frames
 
-        # Write Frame Section
-        for t in self.atlas.textures:
-            for f in t.frames:
-                file.write(struct.pack(frm_fmt, f.x, f.y, f.width, f.height))
+        file.write(buf)
 
 
 class JsonTextureAtlasMap:
@@ -239,19 +485,18 @@ class JsonTextureAtlasMap:
 
     def write(self, file: TextIO) -> None:
         """Writes the JSON texture atlas map."""
-        json.dump(
-            {
-                texture.name: [
-                    (
-                        frame.x,
-                        (self.atlas.height - 1) - frame.y - (frame.height - 1),
-                        frame.width,
-                        frame.height,
-                    )
-                    for frame in texture.frames
-                ]
-                for texture in self.atlas.textures
-            },
-            file,
-            indent=2,
-        )
+        height = self.atlas.height
+
+        # Flip the Y axis so that it points up, with the origin at the bottom
+        payload = {
+            texture.name: [
+                (frame.x, height - frame.y - frame.height, frame.width, frame.height)
+                for frame in texture.frames
+            ]
+            for texture in self.atlas.textures
+        }
+
+        if orjson is not None:
+            file.write(orjson.dumps(payload, option=orjson.OPT_INDENT_2).decode())
+        else:
+            json.dump(payload, file, indent=2)